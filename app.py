@@ -16,15 +16,83 @@ Intended use:
 
 import os
 import sys
-import json
 import time
 import argparse
-from typing import List, Dict, Any
-from web3 import Web3
+import asyncio
+import functools
+import heapq
+import operator
+import re
+import tempfile
+from typing import Any, Callable, Dict, List, Tuple
+import aiohttp
+from Crypto.Hash import keccak
+from hexbytes import HexBytes
+from web3 import AsyncWeb3, Web3
+from web3.types import RPCEndpoint
+
+# Optional speedups: orjson is preferred; otherwise simplejson's C encoder,
+# falling back to the stdlib json module.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import simplejson as json
+except ImportError:
+    import json
 
 DEFAULT_RPC = os.getenv("RPC_URL", "https://mainnet.infura.io/v3/your_api_key")
 DEFAULT_BLOCKS = int(os.getenv("BRIDGE_SNAPSHOT_BLOCKS", "2000"))
 DEFAULT_MAX_LOGS = int(os.getenv("BRIDGE_SNAPSHOT_MAX_LOGS", "5000"))
+DEFAULT_SHARDS = int(os.getenv("BRIDGE_SNAPSHOT_SHARDS", "1"))
+DEFAULT_PAGE_BLOCKS = int(os.getenv("BRIDGE_SNAPSHOT_PAGE_BLOCKS", "0"))
+DEFAULT_ENCODING = os.getenv("BRIDGE_SNAPSHOT_ENCODING", "zkbes-v1")
+# Keep-alive connection pool size; 100 is aiohttp's default, and the env var
+# can only raise it.
+HTTP_POOL_SIZE = max(100, int(os.getenv("BRIDGE_SNAPSHOT_HTTP_POOL", "100")))
+DEFAULT_CACHE_DIR = os.getenv(
+    "BRIDGE_SNAPSHOT_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "zk_bridge_events"),
+)
+DEFAULT_FINALITY_DEPTH = int(os.getenv("BRIDGE_SNAPSHOT_FINALITY_DEPTH", "64"))
+
+GET_LOGS = RPCEndpoint("eth_getLogs")
+
+# Substrings of provider errors signalling that a single eth_getLogs call hit
+# the per-call result cap (Infura / Alchemy style); such ranges get bisected.
+TOO_MANY_RESULTS_MARKERS = (
+    "query returned more than",
+    "log response size exceeded",
+)
+
+# Logs are carried as compact tuples in this field order until output time.
+LOG_FIELDS = ("blockNumber", "transactionHash", "logIndex", "data", "topics")
+LogRow = Tuple[int, str, int, str, List[str]]
+
+# Domain-separation prefixes for Merkle hashing, so a 64-byte leaf preimage
+# can never be confused with an internal node (left || right).
+MERKLE_LEAF_PREFIX = b"\x00"
+MERKLE_NODE_PREFIX = b"\x01"
+
+# Shapes accepted for log fields from the node or the cache: 32-byte hashes
+# and topics, and data of whole bytes. Matching is case-insensitive; values
+# are lowercased so the commitment does not depend on the provider's casing.
+HASH32_RE = re.compile(r"0x[0-9a-fA-F]{64}\Z")
+HEX_DATA_RE = re.compile(r"0x(?:[0-9a-fA-F]{2})*\Z")
+
+# Canonical snapshot order: (blockNumber, logIndex).
+CHAIN_ORDER_KEY = operator.itemgetter(0, 2)
+
+# Canonical per-log encodings the commitment can be computed over.
+ENCODINGS = ("zkbes-v1", "json")
+
+# Bumped whenever the layout of cached ranges changes.
+CACHE_VERSION = 1
+
+# Reused across calls when orjson is unavailable.
+CANONICAL_ENCODER = json.JSONEncoder(sort_keys=True, separators=(",", ":"))
+PRETTY_ENCODER = json.JSONEncoder(sort_keys=True, indent=2, separators=(",", ": "))
 
 NETWORKS: Dict[int, str] = {
     1: "Ethereum Mainnet",
@@ -40,28 +108,50 @@ def network_name(cid: int) -> str:
     return NETWORKS.get(cid, f"Unknown (chain ID {cid})")
 
 
-def connect(rpc: str) -> Web3:
+async def connect(rpc: str) -> Tuple[AsyncWeb3, int, int]:
+    """Connect and return (w3, chain_id, tip) so callers need not re-query them."""
     start = time.time()
-    w3 = Web3(Web3.HTTPProvider(rpc, request_kwargs={"timeout": 25}))
-
-    if not w3.is_connected():
-        print(f"❌ Failed to connect to RPC endpoint: {rpc}", file=sys.stderr)
-        sys.exit(1)
-
-    latency = time.time() - start
+    # Per-phase timeouts rather than a total: time spent queued for a pooled
+    # connection during a wide shard fan-out or bisection must not count.
+    timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=25)
+    # web3's default ExceptionRetryConfiguration (5 retries with backoff) is
+    # kept for transient connection errors.
+    provider = AsyncWeb3.AsyncHTTPProvider(rpc, request_kwargs={"timeout": timeout})
+    # One keep-alive session for all RPC traffic, so concurrent shards reuse
+    # TCP/TLS connections instead of reconnecting.
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=HTTP_POOL_SIZE, limit_per_host=HTTP_POOL_SIZE),
+        timeout=timeout,
+    )
+    # Any failure from here on (including sys.exit) must close the session,
+    # otherwise aiohttp warns about an unclosed client session on exit.
     try:
-        cid = int(w3.eth.chain_id)
-        tip = int(w3.eth.block_number)
-        print(
-            f"🌐 Connected to {network_name(cid)} (chainId {cid}, tip={tip}) in {latency:.2f}s",
-            file=sys.stderr,
-        )
-    except Exception:
-        print(f"🌐 Connected to RPC (chain info unavailable) in {latency:.2f}s", file=sys.stderr)
+        await provider.cache_async_session(session)
+        w3 = AsyncWeb3(provider)
+
+        if not await w3.is_connected():
+            print(f"❌ Failed to connect to RPC endpoint: {rpc}", file=sys.stderr)
+            sys.exit(1)
+
+        latency = time.time() - start
+        try:
+            cid, tip = await asyncio.gather(w3.eth.chain_id, w3.eth.block_number)
+            cid, tip = int(cid), int(tip)
+        except Exception as e:
+            print(f"❌ Connected to RPC but chain info is unavailable: {e}", file=sys.stderr)
+            sys.exit(1)
+    except BaseException:
+        await session.close()
+        raise
 
-    return w3
+    print(
+        f"🌐 Connected to {network_name(cid)} (chainId {cid}, tip={tip}) in {latency:.2f}s",
+        file=sys.stderr,
+    )
+    return w3, cid, tip
 
 
+@functools.lru_cache(maxsize=256)
 def normalize_address(addr: str) -> str:
     try:
         return Web3.to_checksum_address(addr.strip())
@@ -78,107 +168,503 @@ def hex_or_none(value: Any) -> str | None:
         return None
 
 
-def fetch_logs(
-    w3: Web3,
+def dump_json(obj: Any, pretty: bool = False) -> bytes:
+    """Sorted-key JSON as bytes; compact unless pretty (compact form is canonical)."""
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(obj, option=option)
+    return (PRETTY_ENCODER if pretty else CANONICAL_ENCODER).encode(obj).encode()
+
+
+def load_json(data: bytes) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def canonical_log_json(row: LogRow) -> bytes:
+    return dump_json(log_dict(row))
+
+
+@functools.lru_cache(maxsize=None)
+def compile_log_serializer(topic_count: int) -> Callable[[LogRow], bytes]:
+    """
+    Build a serializer specialised for rows with exactly topic_count topics,
+    producing the same bytes as canonical_log_json from a single f-string.
+    Rows with a different topic count fall back to canonical_log_json.
+
+    Strings are inserted without JSON escaping. That is only byte-identical
+    because every row comes from normalize_logs or cache_read, whose
+    checked_row restricts each string field to lowercase 0x-prefixed hex.
+    Rows built any other way must pass through checked_row first.
+    """
+    topics = ",".join('"{r[4][%d]}"' % i for i in range(topic_count))
+    body = (
+        '{{"blockNumber":{r[0]},"data":"{r[3]}","logIndex":{r[2]},"topics":['
+        + topics
+        + '],"transactionHash":"{r[1]}"}}'
+    )
+    src = "lambda r: f'%s'.encode() if len(r[4]) == %d else fallback(r)" % (body, topic_count)
+    return eval(compile(src, f"<log_serializer_{topic_count}>", "eval"), {"fallback": canonical_log_json})
+
+
+def log_serializer(rows: List[LogRow]) -> Callable[[LogRow], bytes]:
+    """Pick a serializer specialised for the topic count of the first row."""
+    if not rows:
+        return canonical_log_json
+    return compile_log_serializer(len(rows[0][4]))
+
+
+def encode_log_zkbes_v1(row: LogRow) -> bytes:
+    """
+    zkbes-v1 binary leaf encoding: blockNumber (8 bytes BE) | transactionHash
+    (32) | logIndex (4 BE) | topic count (1) | topics (32 each) | data length
+    (4 BE) | data. Raises ValueError for any field that does not fit, so every
+    record stays self-delimiting.
+    """
+    bn, txh, idx, data, topics = row
+    tx_bytes = bytes.fromhex(txh[2:])
+    topic_bytes = [bytes.fromhex(t[2:]) for t in topics]
+    data_bytes = bytes.fromhex(data[2:])
+    if len(tx_bytes) != 32 or any(len(t) != 32 for t in topic_bytes):
+        raise ValueError(f"zkbes-v1 needs 32-byte transactionHash and topics: {row!r}")
+    try:
+        return b"".join(
+            (
+                bn.to_bytes(8, "big"),
+                tx_bytes,
+                idx.to_bytes(4, "big"),
+                len(topic_bytes).to_bytes(1, "big"),
+                *topic_bytes,
+                len(data_bytes).to_bytes(4, "big"),
+                data_bytes,
+            )
+        )
+    except OverflowError:
+        raise ValueError(f"Log field out of range for zkbes-v1: {row!r}")
+
+
+def log_encoder(rows: List[LogRow], encoding: str) -> Callable[[LogRow], bytes]:
+    if encoding == "json":
+        return log_serializer(rows)
+    return encode_log_zkbes_v1
+
+
+def commit_logs(rows: List[LogRow], encoding: str = DEFAULT_ENCODING) -> str:
+    """
+    Flat Keccak-256 over all logs, streamed one entry at a time. JSON entries
+    are framed as a JSON array; zkbes-v1 entries are self-delimiting and are
+    simply concatenated.
+    """
+    encode = log_encoder(rows, encoding)
+    framed = encoding == "json"
+    h = keccak.new(digest_bits=256)
+    if framed:
+        h.update(b"[")
+    for i, row in enumerate(rows):
+        if framed and i:
+            h.update(b",")
+        h.update(encode(row))
+    if framed:
+        h.update(b"]")
+    return "0x" + h.hexdigest()
+
+
+def keccak_digest(data: bytes) -> bytes:
+    return keccak.new(digest_bits=256, data=data).digest()
+
+
+def merkle_root(leaves: List[bytes]) -> bytes:
+    """
+    Binary Keccak Merkle root over leaf hashes; parents are
+    keccak(0x01 || left || right) and an odd node at any level is paired with
+    itself.
+    """
+    if not leaves:
+        return keccak_digest(b"")
+    level = leaves
+    while len(level) > 1:
+        if len(level) % 2:
+            level = level + [level[-1]]
+        level = [
+            keccak_digest(MERKLE_NODE_PREFIX + level[i] + level[i + 1])
+            for i in range(0, len(level), 2)
+        ]
+    return level[0]
+
+
+def merkle_commit_logs(rows: List[LogRow], encoding: str = DEFAULT_ENCODING) -> str:
+    """Merkle root over keccak(0x00 || encoded log) of each log, in snapshot order."""
+    encode = log_encoder(rows, encoding)
+    leaves = [keccak_digest(MERKLE_LEAF_PREFIX + encode(row)) for row in rows]
+    return "0x" + merkle_root(leaves).hex()
+
+
+def bytes_to_hex(value: Any) -> str:
+    """0x-prefixed hex for HexBytes/bytes without going through web3's encoder."""
+    if hasattr(value, "to_0x_hex"):
+        return value.to_0x_hex()
+    return "0x" + bytes(value).hex()
+
+
+def checked_hex(value: Any, pattern: re.Pattern, field: str) -> str:
+    if not isinstance(value, str) or not pattern.match(value):
+        raise ValueError(f"Malformed {field} in log: {value!r}")
+    return value.lower()
+
+
+def checked_row(bn: Any, txh: Any, idx: Any, data: Any, topics: Any) -> LogRow:
+    """Validate one log's fields and return them as a canonical LogRow."""
+    if not isinstance(bn, int) or not isinstance(idx, int) or not isinstance(topics, list):
+        raise ValueError(f"Malformed log entry: {(bn, txh, idx, data, topics)!r}")
+    return (
+        bn,
+        checked_hex(txh, HASH32_RE, "transactionHash"),
+        idx,
+        checked_hex(data, HEX_DATA_RE, "data"),
+        [checked_hex(t, HASH32_RE, "topic") for t in topics],
+    )
+
+
+def normalize_logs(logs_raw: List[Dict[str, Any]]) -> List[LogRow]:
+    """
+    Convert raw eth_getLogs JSON entries into LOG_FIELDS-ordered rows. The
+    node's strings bypass web3's formatters, so every field is checked here;
+    a malformed entry raises ValueError.
+    """
+    return [
+        checked_row(
+            int(lg["blockNumber"], 16),
+            lg["transactionHash"],
+            int(lg["logIndex"], 16),
+            lg["data"],
+            lg["topics"],
+        )
+        for lg in logs_raw
+    ]
+
+
+def log_dict(row: LogRow) -> Dict[str, Any]:
+    return dict(zip(LOG_FIELDS, row))
+
+
+def ensure_chain_order(rows: List[LogRow]) -> List[LogRow]:
+    """Return rows in (blockNumber, logIndex) order, sorting only if they are not already."""
+    key = CHAIN_ORDER_KEY
+    if all(key(a) <= key(b) for a, b in zip(rows, rows[1:])):
+        return rows
+    return sorted(rows, key=key)
+
+
+def count_unique_txs(rows: List[LogRow]) -> int:
+    """
+    Distinct tx hashes, counted as runs of equal transactionHash. This is only
+    exact for rows in chain order, where each tx's logs are contiguous;
+    fetch_logs guarantees that via ensure_chain_order before merging.
+    """
+    count = 0
+    prev = None
+    for row in rows:
+        if row[1] != prev:
+            count += 1
+            prev = row[1]
+    return count
+
+
+def block_ranges(from_block: int, to_block: int, step: int) -> List[Tuple[int, int]]:
+    return [(lo, min(lo + step - 1, to_block)) for lo in range(from_block, to_block + 1, step)]
+
+
+def shard_ranges(from_block: int, to_block: int, shards: int) -> List[Tuple[int, int]]:
+    span = to_block - from_block + 1
+    return block_ranges(from_block, to_block, max(1, -(-span // max(1, shards))))
+
+
+def cache_path(
+    cache_dir: str, chain_id: int, addr: str, lo: int, hi: int, topic0: str | None
+) -> str:
+    key = keccak_digest(dump_json([CACHE_VERSION, chain_id, addr, lo, hi, topic0])).hex()
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+def cache_read(path: str) -> List[LogRow] | None:
+    """Load a cached range; unreadable or malformed entries count as a miss and are refetched."""
+    try:
+        with open(path, "rb") as f:
+            return [checked_row(*r) for r in load_json(f.read())]
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def cache_write(path: str, logs: List[LogRow]) -> None:
+    """Write normalized logs for one range atomically (tmpfile + rename)."""
+    cache_dir = os.path.dirname(path)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(dump_json(logs))
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    except OSError as e:
+        print(f"⚠️  Could not write cache entry {path}: {e}", file=sys.stderr)
+
+
+def is_too_many_results(error: Any) -> bool:
+    """True if an exception or JSON-RPC error object reports a result-cap hit."""
+    msg = str(error).lower()
+    return any(marker in msg for marker in TOO_MANY_RESULTS_MARKERS)
+
+
+def range_params(params: Dict[str, Any], lo: int, hi: int) -> Dict[str, Any]:
+    return {**params, "fromBlock": hex(lo), "toBlock": hex(hi)}
+
+
+def rpc_result(response: Dict[str, Any]) -> Any:
+    if "error" in response:
+        raise ValueError(response["error"])
+    return response["result"]
+
+
+async def get_logs_range(w3: AsyncWeb3, params: Dict[str, Any], lo: int, hi: int) -> List[Any]:
+    """
+    Fetch raw logs for [lo, hi], bisecting the range when the provider caps
+    results. The request goes straight to the provider, skipping web3's
+    middleware and result formatters: the node's hex strings are used as-is.
+    """
+    try:
+        response = await w3.provider.make_request(GET_LOGS, [range_params(params, lo, hi)])
+        return rpc_result(response)
+    except Exception as e:
+        if lo >= hi or not is_too_many_results(e):
+            raise
+    return await bisect_logs_range(w3, params, lo, hi)
+
+
+async def bisect_logs_range(w3: AsyncWeb3, params: Dict[str, Any], lo: int, hi: int) -> List[Any]:
+    mid = (lo + hi) // 2
+    left, right = await asyncio.gather(
+        get_logs_range(w3, params, lo, mid), get_logs_range(w3, params, mid + 1, hi)
+    )
+    return left + right
+
+
+def match_batch_responses(batch: Any, count: int) -> List[Dict[str, Any]] | None:
+    """
+    Order batch responses by request, keyed on their JSON-RPC ids; responses
+    may arrive in any order. web3 numbers the requests of one batch with
+    consecutive ids in request order, so the lowest id is the first range.
+    Returns None on a count mismatch or a missing, duplicate or unknown id.
+    """
+    if not isinstance(batch, list) or len(batch) != count:
+        return None
+    ids = [r.get("id") if isinstance(r, dict) else None for r in batch]
+    if not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return None
+    first = min(ids)
+    by_position = {i - first: r for i, r in zip(ids, batch)}
+    if sorted(by_position) != list(range(count)):
+        return None
+    return [by_position[i] for i in range(count)]
+
+
+async def fetch_ranges(
+    w3: AsyncWeb3, params: Dict[str, Any], ranges: List[Tuple[int, int]]
+) -> List[List[Any]]:
+    """
+    Fetch every range, preferring one batched JSON-RPC round-trip. Ranges whose
+    batch entry failed (or all of them, if the batch itself failed or could
+    not be matched to its requests) are retried individually with bisection.
+    """
+    responses: List[Dict[str, Any] | None] = [None] * len(ranges)
+    if len(ranges) > 1 and hasattr(w3.provider, "make_batch_request"):
+        try:
+            batch = await w3.provider.make_batch_request(
+                [(GET_LOGS, [range_params(params, lo, hi)]) for lo, hi in ranges]
+            )
+            if not isinstance(batch, list):
+                raise ValueError(batch.get("error", batch))
+            matched = match_batch_responses(batch, len(ranges))
+            if matched is None:
+                raise ValueError(
+                    f"{len(batch)} response(s) for {len(ranges)} request(s) could not be matched by id"
+                )
+            responses = matched
+        except Exception as e:
+            print(f"⚠️  Batched eth_getLogs failed ({e}); retrying per shard.", file=sys.stderr)
+
+    async def settle(response: Dict[str, Any] | None, lo: int, hi: int) -> List[Any]:
+        if response is not None:
+            if "result" in response:
+                return response["result"]
+            if lo < hi and is_too_many_results(response.get("error")):
+                return await bisect_logs_range(w3, params, lo, hi)
+        return await get_logs_range(w3, params, lo, hi)
+
+    return list(
+        await asyncio.gather(*(settle(r, lo, hi) for r, (lo, hi) in zip(responses, ranges)))
+    )
+
+
+async def fetch_cached_ranges(
+    w3: AsyncWeb3,
+    params: Dict[str, Any],
+    ranges: List[Tuple[int, int]],
+    paths: List[str | None],
+    final_block: int,
+) -> Tuple[List[List[LogRow]], int]:
+    """
+    Return normalized logs per range, reading finalized ranges from the disk
+    cache and fetching the rest. Also returns the number of cache hits.
+    """
+    results = [cache_read(p) if p else None for p in paths]
+    missing = [i for i, r in enumerate(results) if r is None]
+    if missing:
+        fetched = await fetch_ranges(w3, params, [ranges[i] for i in missing])
+        for i, raw in zip(missing, fetched):
+            results[i] = normalize_logs(raw)
+            if paths[i] and ranges[i][1] <= final_block:
+                cache_write(paths[i], results[i])
+    return results, len(ranges) - len(missing)
+
+
+async def fetch_logs(
+    w3: AsyncWeb3,
+    chain_id: int,
+    tip: int,
     address: str,
     from_block: int,
     to_block: int,
     topic0: str | None,
     max_logs: int,
+    shards: int = 1,
+    merkle: bool = False,
+    page_blocks: int = 0,
+    cache_dir: str | None = None,
+    finality_depth: int = DEFAULT_FINALITY_DEPTH,
+    encoding: str = DEFAULT_ENCODING,
 ) -> Dict[str, Any]:
     if from_block > to_block:
         from_block, to_block = to_block, from_block
 
     addr = normalize_address(address)
-    latest = int(w3.eth.block_number)
-    to_block = min(to_block, latest)
+    to_block = min(to_block, tip)
 
     print(
         f"🔍 Fetching logs for {addr} from block {from_block} to {to_block}...",
         file=sys.stderr,
     )
 
-    topics = None
+    topic0_bytes = None
     if topic0:
         t0 = topic0.strip()
         if not t0.startswith("0x") or len(t0) != 66:
             print("⚠️  topic0 does not look like a 32-byte hex value; continuing anyway.", file=sys.stderr)
-        topics = [t0]
+        try:
+            topic0_bytes = HexBytes(t0)
+        except ValueError:
+            print(f"❌ topic0 is not valid hex: {topic0!r}", file=sys.stderr)
+            sys.exit(1)
 
     params: Dict[str, Any] = {
-        "fromBlock": from_block,
-        "toBlock": to_block,
         "address": addr,
     }
-    if topics is not None:
-        params["topics"] = [topics[0]]
+    if topic0_bytes is not None:
+        params["topics"] = [bytes_to_hex(topic0_bytes)]
+
+    if page_blocks > 0:
+        ranges = block_ranges(from_block, to_block, page_blocks)
+    else:
+        ranges = shard_ranges(from_block, to_block, shards)
+
+    topic_key = params["topics"][0] if topic0_bytes is not None else None
+    paths = [
+        cache_path(cache_dir, chain_id, addr, lo, hi, topic_key) if cache_dir else None
+        for lo, hi in ranges
+    ]
+    final_block = tip - finality_depth
 
+    # Ranges are fetched in ascending waves of `shards`; once max_logs is
+    # reached the remaining pages cannot contribute to the snapshot.
     t0 = time.time()
+    shard_results: List[List[LogRow]] = []
+    fetched = 0
+    cache_hits = 0
     try:
-        logs_raw = w3.eth.get_logs(params)
+        for i in range(0, len(ranges), shards):
+            wave, hits = await fetch_cached_ranges(
+                w3, params, ranges[i : i + shards], paths[i : i + shards], final_block
+            )
+            cache_hits += hits
+            shard_results.extend(wave)
+            fetched += sum(len(r) for r in wave)
+            if max_logs > 0 and fetched >= max_logs and i + shards < len(ranges):
+                print(
+                    f"⏹️  Reached max_logs={max_logs} after block {ranges[i + shards - 1][1]}; "
+                    f"skipping {len(ranges) - i - shards} remaining page(s).",
+                    file=sys.stderr,
+                )
+                break
     except Exception as e:
         print(f"❌ Failed to fetch logs: {e}", file=sys.stderr)
         sys.exit(1)
 
+    # eth_getLogs normally returns each range in (blockNumber, logIndex) order,
+    # so a k-way merge yields the canonical snapshot order without a full sort.
+    # Ranges that arrive out of order are sorted first.
+    rows = list(
+        heapq.merge(*(ensure_chain_order(r) for r in shard_results), key=CHAIN_ORDER_KEY)
+    )
+
     elapsed = time.time() - t0
-    print(f"📦 RPC returned {len(logs_raw)} logs in {elapsed:.2f}s", file=sys.stderr)
+    print(
+        f"📦 RPC returned {len(rows)} logs in {elapsed:.2f}s "
+        f"({len(shard_results)} range(s), {cache_hits} from cache)",
+        file=sys.stderr,
+    )
 
-    if max_logs > 0 and len(logs_raw) > max_logs:
+    if max_logs > 0 and len(rows) > max_logs:
         print(
-            f"⚠️  Truncating logs from {len(logs_raw)} to max_logs={max_logs} for commitment.",
+            f"⚠️  Truncating logs from {len(rows)} to max_logs={max_logs} for commitment.",
             file=sys.stderr,
         )
-        logs_raw = logs_raw[:max_logs]
-
-    logs: List[Dict[str, Any]] = []
-    tx_set: set[str] = set()
-    min_block_seen = None
-    max_block_seen = None
-
-    for lg in logs_raw:
-        bn = int(lg["blockNumber"])
-        txh = Web3.to_hex(lg["transactionHash"])
-        idx = int(lg["logIndex"])
-        data_hex = Web3.to_hex(lg["data"])
-        topics_hex = [Web3.to_hex(t) for t in lg["topics"]]
-
-        tx_set.add(txh)
-        if min_block_seen is None or bn < min_block_seen:
-            min_block_seen = bn
-        if max_block_seen is None or bn > max_block_seen:
-            max_block_seen = bn
-
-        logs.append(
-            {
-                "blockNumber": bn,
-                "transactionHash": txh,
-                "logIndex": idx,
-                "data": data_hex,
-                "topics": topics_hex,
-            }
-        )
+        rows = rows[:max_logs]
 
-    logs.sort(key=lambda x: (x["blockNumber"], x["transactionHash"], x["logIndex"]))
+    # The order is block-major, so the effective block bounds are at the ends.
+    min_block_seen = rows[0][0] if rows else None
+    max_block_seen = rows[-1][0] if rows else None
 
-    encoded = json.dumps(logs, sort_keys=True, separators=(",", ":")).encode()
-    commitment = Web3.keccak(encoded).hex()
+    try:
+        if merkle:
+            commitment = merkle_commit_logs(rows, encoding)
+        else:
+            commitment = commit_logs(rows, encoding)
+    except ValueError as e:
+        print(f"❌ Failed to encode logs for the commitment: {e}", file=sys.stderr)
+        sys.exit(1)
 
     meta = {
         "fromBlockRequested": from_block,
         "toBlockRequested": to_block,
         "fromBlockEffective": min_block_seen if min_block_seen is not None else from_block,
         "toBlockEffective": max_block_seen if max_block_seen is not None else to_block,
-        "logCount": len(logs),
-        "uniqueTxCount": len(tx_set),
+        "logCount": len(rows),
+        "uniqueTxCount": count_unique_txs(rows),
         "maxLogs": max_logs,
         "topic0Filter": topic0,
         "elapsedSec": round(elapsed, 3),
         "commitmentKeccak": commitment,
+        "encoding": encoding,
     }
+    if merkle:
+        meta["merkleLeafCount"] = len(rows)
 
     return {
         "meta": meta,
-        "logs": logs,
+        "logs": [log_dict(row) for row in rows],
     }
 
 
@@ -222,6 +708,46 @@ def parse_args() -> argparse.Namespace:
         default=DEFAULT_MAX_LOGS,
         help="Maximum logs to keep in snapshot (0 = no limit).",
     )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=DEFAULT_SHARDS,
+        help="Split the block range into N sub-ranges fetched concurrently.",
+    )
+    parser.add_argument(
+        "--page-blocks",
+        type=int,
+        default=DEFAULT_PAGE_BLOCKS,
+        help="Fetch in pages of N blocks (--shards pages at a time) and stop once "
+        "--max-logs is reached (0 = no paging).",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=DEFAULT_CACHE_DIR,
+        help="Directory for cached eth_getLogs results of finalized ranges.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Disable the on-disk log cache.",
+    )
+    parser.add_argument(
+        "--finality-depth",
+        type=int,
+        default=DEFAULT_FINALITY_DEPTH,
+        help="Only cache ranges ending at least this many blocks below the tip.",
+    )
+    parser.add_argument(
+        "--merkle",
+        action="store_true",
+        help="Commit to a Keccak Merkle root over per-log hashes instead of one flat hash.",
+    )
+    parser.add_argument(
+        "--encoding",
+        choices=ENCODINGS,
+        default=DEFAULT_ENCODING,
+        help="Canonical per-log encoding hashed into the commitment.",
+    )
     parser.add_argument(
         "--pretty",
         action="store_true",
@@ -235,6 +761,56 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+async def run_snapshot(
+    args: argparse.Namespace, bridge_address: str
+) -> Tuple[int, Dict[str, Any], float]:
+    """Connect, resolve the block range and fetch the snapshot on one event loop."""
+    w3, chain_id, tip = await connect(args.rpc)
+    try:
+        if args.from_block is None and args.to_block is None:
+            to_block = tip
+            from_block = max(0, tip - args.blocks + 1)
+        else:
+            to_block = args.to_block if args.to_block is not None else tip
+            from_block = args.from_block if args.from_block is not None else max(
+                0, to_block - args.blocks + 1
+            )
+
+        print(
+            f"📅 zk_bridge_events_snapshot at UTC {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}",
+            file=sys.stderr,
+        )
+        print(
+            f"🔗 Using RPC endpoint: {args.rpc}",
+            file=sys.stderr,
+        )
+        print(
+            f"📚 Block range resolved to [{from_block}, {to_block}] (tip={tip})",
+            file=sys.stderr,
+        )
+
+        t0 = time.time()
+        snapshot = await fetch_logs(
+            w3=w3,
+            chain_id=chain_id,
+            tip=tip,
+            address=bridge_address,
+            from_block=int(from_block),
+            to_block=int(to_block),
+            topic0=args.topic0,
+            max_logs=int(args.max_logs),
+            shards=int(args.shards),
+            merkle=args.merkle,
+            page_blocks=int(args.page_blocks),
+            cache_dir=None if args.no_cache else args.cache_dir,
+            finality_depth=int(args.finality_depth),
+            encoding=args.encoding,
+        )
+        return chain_id, snapshot, time.time() - t0
+    finally:
+        await w3.provider.disconnect()
+
+
 def main() -> None:
     if "your_api_key" in DEFAULT_RPC:
         print(
@@ -248,49 +824,32 @@ def main() -> None:
     if args.blocks <= 0:
         print("❌ --blocks must be > 0", file=sys.stderr)
         sys.exit(1)
+    if args.shards <= 0:
+        print("❌ --shards must be > 0", file=sys.stderr)
+        sys.exit(1)
+    if args.page_blocks < 0:
+        print("❌ --page-blocks must be >= 0", file=sys.stderr)
+        sys.exit(1)
+    if args.finality_depth < 0:
+        print("❌ --finality-depth must be >= 0", file=sys.stderr)
+        sys.exit(1)
+    if args.encoding not in ENCODINGS:
+        print(f"❌ --encoding must be one of {', '.join(ENCODINGS)}", file=sys.stderr)
+        sys.exit(1)
 
-    w3 = connect(args.rpc)
-    tip = int(w3.eth.block_number)
-
-    if args.from_block is None and args.to_block is None:
-        to_block = tip
-        from_block = max(0, tip - args.blocks + 1)
-    else:
-        to_block = args.to_block if args.to_block is not None else tip
-        from_block = args.from_block if args.from_block is not None else max(
-            0, to_block - args.blocks + 1
-        )
-
-    print(
-        f"📅 zk_bridge_events_snapshot at UTC {time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime())}",
-        file=sys.stderr,
-    )
-    print(
-        f"🔗 Using RPC endpoint: {args.rpc}",
-        file=sys.stderr,
-    )
-    print(
-        f"📚 Block range resolved to [{from_block}, {to_block}] (tip={tip})",
-        file=sys.stderr,
-    )
+    try:
+        bridge_address = normalize_address(args.address)
+    except ValueError as e:
+        print(f"❌ {e}", file=sys.stderr)
+        sys.exit(1)
 
-    t0 = time.time()
-    snapshot = fetch_logs(
-        w3=w3,
-        address=args.address,
-        from_block=int(from_block),
-        to_block=int(to_block),
-        topic0=args.topic0,
-        max_logs=int(args.max_logs),
-    )
-    elapsed_total = time.time() - t0
+    chain_id, snapshot, elapsed_total = asyncio.run(run_snapshot(args, bridge_address))
 
-    chain_id = int(w3.eth.chain_id)
     payload = {
         "mode": "zk_bridge_events_snapshot",
         "network": network_name(chain_id),
         "chainId": chain_id,
-        "bridgeAddress": normalize_address(args.address),
+        "bridgeAddress": bridge_address,
         "generatedAtUtc": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
         "data": snapshot,
     }
@@ -318,10 +877,11 @@ def main() -> None:
             file=sys.stderr,
         )
 
-    if args.pretty:
-        print(json.dumps(payload, indent=2, sort_keys=True))
-    else:
-        print(json.dumps(payload, separators=(",", ":"), sort_keys=True))
+    out = dump_json(payload, pretty=args.pretty)
+    sys.stdout.flush()
+    sys.stdout.buffer.write(out)
+    sys.stdout.buffer.write(b"\n")
+    sys.stdout.buffer.flush()
 
 
 if __name__ == "__main__":